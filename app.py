@@ -1,18 +1,17 @@
 import os
 from functools import wraps
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, Response, jsonify
+from flask import Flask, render_template, request, jsonify
 from flask_cors import CORS
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room, leave_room
 from firebase_admin import auth as fbauth, db
 
 # --- Fix OpenCV backend for Windows webcams ---
 os.environ["OPENCV_VIDEOIO_PRIORITY_MSMF"] = "0"   # disable MSMF
 os.environ["OPENCV_VIDEOIO_PRIORITY_DSHOW"] = "1"  # force DSHOW
 
-import cv2
 import firebase_manager as fm
-from yolov8_detection import mjpeg_generator, CameraWorker
+from yolov8_detection import CameraWorker, get_inference_server, video_room
 
 # --------------------------------------------------------------------------------------
 # App setup
@@ -32,6 +31,14 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
 # Ensure default admin exists at startup
 fm.ensure_default_admin()
 
+# Load and warm the model at startup so the first camera frame doesn't stall on it
+if os.getenv("YOLO_WARM_START", "1") == "1":
+    try:
+        get_inference_server()
+    except Exception:
+        # Keep the app up; the model is loaded lazily again when cameras start
+        app.logger.exception("YOLO warm start failed; falling back to lazy loading")
+
 # Camera workers map
 camera_workers = {}
 
@@ -55,12 +62,10 @@ def verify_firebase_token(fn):
     return wrapper
 
 def require_admin(fn):
-    """Decorator: only allow if user has role=admin in Firebase DB"""
+    """Decorator: only allow if the verified token carries the role=admin custom claim"""
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        uid = request.user.get("uid")
-        u = fm.get_user(uid) or {}
-        if u.get("role") != "admin":
+        if request.user.get("role") != "admin":
             return jsonify({"error": "forbidden"}), 403
         return fn(*args, **kwargs)
     return wrapper
@@ -72,51 +77,6 @@ def require_admin(fn):
 def index():
     return render_template("index.html")
 
-# --------- Video stream route (public; UI restricts visibility) ---------
-def _find_working_source(source_hint=0):
-    """Try given source, then fallback to 0,1,2 until one opens."""
-    sources_to_try = [source_hint] + [i for i in range(3) if i != source_hint]
-    for src in sources_to_try:
-        try:
-            if isinstance(src, str) and src.isdigit():
-                src = int(src)
-            cap = cv2.VideoCapture(src, cv2.CAP_DSHOW)
-            if cap.isOpened():
-                ok, _ = cap.read()
-                cap.release()
-                if ok:
-                    print(f"✅ Camera source found: {src}")
-                    return src
-            cap.release()
-        except Exception:
-            continue
-    return None
-
-@app.route("/api/video_feed")
-def video_feed():
-    """Return MJPEG stream if available, else placeholder image."""
-    camera = request.args.get("camera", "default")
-    cams = fm.list_cameras()
-    source = 0
-    if camera != "default" and cams:
-        for cid, c in cams.items():
-            if cid == camera or c.get("name") == camera:
-                source = c.get("source", 0)
-                break
-
-    working_src = _find_working_source(source)
-    if working_src is None:
-        placeholder = os.path.join(app.static_folder, "placeholder.jpg")
-        if os.path.exists(placeholder):
-            with open(placeholder, "rb") as f:
-                return Response(f.read(), mimetype="image/jpeg")
-        return Response("Camera source unavailable", status=503)
-
-    return Response(
-        mjpeg_generator(working_src),
-        mimetype="multipart/x-mixed-replace; boundary=frame"
-    )
-
 # --------- Dashboard snapshot ---------
 @app.route("/api/status")
 @verify_firebase_token
@@ -131,7 +91,7 @@ def status():
             "camerasActive": len(camera_workers),
             "alertsToday": [],
             "error": str(e),
-            "hint": "Add .indexOn: ['createdAt'] to RTDB rules for /dashboard/alertsToday"
+            "hint": "Merge the .indexOn entries from database.indexes.json into your RTDB rules"
         }), 200
 
 # --------- Alerts verify/dismiss ---------
@@ -152,7 +112,11 @@ def resolve_alert():
             "threatLevel": det.get("threatLevel"),
             "status": "verified"
         }
-        fm.save_detection_verified(payload)
+        try:
+            fm.save_detection_verified(payload)
+        except Exception as e:
+            app.logger.exception("save_detection_verified failed")
+            return jsonify({"error": str(e)}), 500
     return jsonify({"ok": True})
 
 # --------- Cameras management ---------
@@ -203,6 +167,22 @@ def set_language():
 def on_connect():
     pass
 
+# Live video: a dashboard joins one camera's room to receive its binary "frame" events
+@socketio.on("watch", namespace="/stream")
+def on_watch(data=None):
+    """Join the requested camera's room (default: first running). Acks the camera id, or None if none is running."""
+    camera = (data or {}).get("camera") or next(iter(camera_workers), None)
+    if camera not in camera_workers:
+        return None
+    join_room(video_room(camera))
+    return camera
+
+@socketio.on("unwatch", namespace="/stream")
+def on_unwatch(data=None):
+    camera = (data or {}).get("camera")
+    if camera:
+        leave_room(video_room(camera))
+
 # --------------------------------------------------------------------------------------
 # Camera control (on-demand start/stop by admin)
 # --------------------------------------------------------------------------------------
@@ -219,7 +199,8 @@ def start_all_cameras():
     else:
         for cam_id, c in cams.items():
             source = c.get("source", 0)
-            if cam_id not in camera_workers:
+            # Replace workers that exited (e.g. the model failed to load) so a restart retries them
+            if cam_id not in camera_workers or not camera_workers[cam_id].is_alive():
                 worker = CameraWorker(camera_id=cam_id, source=source, socketio=socketio)
                 worker.start()
                 camera_workers[cam_id] = worker
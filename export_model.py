@@ -0,0 +1,38 @@
+"""
+One-off export of best.pt to an ahead-of-time compiled runtime.
+
+    python export_model.py            # TensorRT engine -> best.engine
+    python export_model.py openvino   # INT8 OpenVINO IR -> best_openvino_model/
+
+The engine is specialized for this GPU and a fixed input size, so run the
+export on the deployment machine with the same YOLO_IMGSZ the app uses.
+The OpenVINO export is for CPU-only hosts and needs a calibration dataset
+yaml (YOLO_CALIB_DATA, default calib.yaml) for INT8 quantization.
+"""
+import os
+import sys
+from dotenv import load_dotenv
+from ultralytics import YOLO
+
+load_dotenv()
+SOURCE_WEIGHTS = os.getenv("YOLO_SOURCE_WEIGHTS", "best.pt")
+IMGSZ = int(os.getenv("YOLO_IMGSZ", "480"))
+CALIB_DATA = os.getenv("YOLO_CALIB_DATA", "calib.yaml")
+
+
+def export_engine() -> str:
+    return YOLO(SOURCE_WEIGHTS).export(
+        format="engine", half=True, imgsz=IMGSZ, dynamic=False, workspace=4
+    )
+
+
+def export_openvino_int8() -> str:
+    return YOLO(SOURCE_WEIGHTS).export(
+        format="openvino", int8=True, data=CALIB_DATA, imgsz=IMGSZ, dynamic=False
+    )
+
+
+if __name__ == "__main__":
+    fmt = sys.argv[1] if len(sys.argv) > 1 else "engine"
+    path = export_openvino_int8() if fmt == "openvino" else export_engine()
+    print(f"✅ Exported {SOURCE_WEIGHTS} -> {path}")
@@ -1,6 +1,11 @@
 import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Tuple, Optional
 
 import firebase_admin
 from firebase_admin import credentials, db, auth
@@ -36,6 +41,88 @@ if not firebase_admin._apps:
 def _now_iso():
     return datetime.now(timezone.utc).isoformat()
 
+# ----- Background writer -----
+# Fire-and-forget RTDB writes: callers enqueue (ref_path, op, payload, on_done) and
+# return immediately; a single consumer applies them in order and reports the
+# outcome to on_done(ok) when one is given.
+_write_q: "queue.Queue[tuple]" = queue.Queue()
+
+
+def _writer():
+    while True:
+        ref_path, op, payload, on_done = _write_q.get()
+        ok = True
+        try:
+            ref = db.reference(ref_path)
+            if op == "trim":
+                _trim(ref, payload)
+            else:
+                getattr(ref, op)(payload)
+        except Exception as e:
+            ok = False
+            print(f"⚠️ RTDB {op} {ref_path} failed: {e}")
+        if on_done:
+            try:
+                on_done(ok)
+            except Exception as e:
+                print(f"⚠️ RTDB {op} {ref_path} callback failed: {e}")
+
+
+def _trim(ref, keep: int):
+    """Delete all but the newest `keep` children (push keys sort chronologically)."""
+    keys = sorted((ref.get(shallow=True) or {}).keys())
+    stale = keys[:-keep] if keep else keys
+    if stale:
+        ref.update({k: None for k in stale})
+
+
+threading.Thread(target=_writer, daemon=True).start()
+
+
+def _enqueue(ref_path: str, op: str, payload: Any, on_done: Optional[Callable[[bool], None]] = None):
+    _write_q.put((ref_path, op, payload, on_done))
+
+
+_PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+def _push_key() -> str:
+    """Generate a chronologically sortable push id locally (admin push() would cost a round-trip)."""
+    ms = int(time.time() * 1000)
+    ts = ""
+    for _ in range(8):
+        ts = _PUSH_CHARS[ms % 64] + ts
+        ms //= 64
+    return ts + "".join(random.choice(_PUSH_CHARS) for _ in range(12))
+
+# ----- Read cache -----
+# Short-TTL cache for reads on hot API paths; writers through this module invalidate their keys.
+CACHE_TTL = 30.0
+_cache: Dict[str, Tuple[float, Any]] = {}
+# Bumped on every invalidation so a load that started before it is not stored
+_cache_gen: Dict[str, int] = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(key: str, loader: Callable[[], Any]) -> Any:
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+        gen = _cache_gen.get(key, 0)
+    if hit and now - hit[0] < CACHE_TTL:
+        return hit[1]
+    value = loader()
+    with _cache_lock:
+        if _cache_gen.get(key, 0) == gen:
+            _cache[key] = (now, value)
+    return value
+
+
+def _invalidate(key: str):
+    with _cache_lock:
+        _cache.pop(key, None)
+        _cache_gen[key] = _cache_gen.get(key, 0) + 1
+
 # ----- Users & roles -----
 def ensure_default_admin():
     """Create default admin user if not present (admin@example.com / admin123)."""
@@ -60,6 +147,7 @@ def ensure_default_admin():
         "prefs": {"language": "english"},
         "createdAt": _now_iso()
     })
+    _invalidate(f"/users/{uid}")
     return uid
 
 
@@ -75,6 +163,7 @@ def create_user(name: str, email: str, password: str, role: str):
         "prefs": {"language": "english"},
         "createdAt": _now_iso()
     })
+    _invalidate(f"/users/{uid}")
     return uid
 
 
@@ -85,15 +174,16 @@ def update_user_password(uid: str, new_password: str):
 
 def set_user_language(uid: str, language: str):
     db.reference(f"/users/{uid}/prefs").update({"language": language.lower()})
+    _invalidate(f"/users/{uid}")
     return True
 
 
 def get_user(uid: str) -> Dict[str, Any]:
-    return db.reference(f"/users/{uid}").get() or {}
+    return _cached(f"/users/{uid}", lambda: db.reference(f"/users/{uid}").get() or {})
 
 # ----- Cameras -----
 def list_cameras() -> Dict[str, Any]:
-    return db.reference("/cameras").get() or {}
+    return _cached("/cameras", lambda: db.reference("/cameras").get() or {})
 
 
 def add_camera(name: str, source: str) -> str:
@@ -103,11 +193,13 @@ def add_camera(name: str, source: str) -> str:
         "active": True,
         "createdAt": _now_iso()
     })
+    _invalidate("/cameras")
     return ref.key
 
 
 def update_camera(camera_id: str, data: Dict[str, Any]):
     db.reference(f"/cameras/{camera_id}").update(data)
+    _invalidate("/cameras")
 
 
 def cameras_active_count() -> int:
@@ -116,17 +208,25 @@ def cameras_active_count() -> int:
 
 # ----- System status & dashboard data -----
 def set_system_status(running: bool):
-    db.reference("/system/status").set({"running": running, "updatedAt": _now_iso()})
+    _enqueue("/system/status", "set", {"running": running, "updatedAt": _now_iso()})
 
 
-def set_threat_level(level: str):
-    db.reference("/system/threatLevel").set({"level": level, "updatedAt": _now_iso()})
+# Shared pool so the dashboard's independent reads overlap instead of running back to back.
+# Each /api/status call uses 3 slots; size for several dashboards polling at once.
+_read_pool = ThreadPoolExecutor(max_workers=24, thread_name_prefix="rtdb-read")
 
 
 def get_dashboard_snapshot():
-    status = db.reference("/system/status").get() or {"running": False}
-    threat = db.reference("/system/threatLevel").get() or {"level": "low"}
-    alerts_today = db.reference("/dashboard/alertsToday").order_by_child("createdAt").limit_to_last(3).get() or {}
+    status_f = _read_pool.submit(lambda: db.reference("/system/status").get())
+    threat_f = _read_pool.submit(lambda: db.reference("/system/threatLevel").get())
+    alerts_f = _read_pool.submit(
+        lambda: db.reference("/dashboard/alertsToday").order_by_child("createdAt").limit_to_last(3).get()
+    )
+    # Served from the /cameras cache, so it runs on the request thread
+    cameras_active = cameras_active_count()
+    status = status_f.result() or {"running": False}
+    threat = threat_f.result() or {"level": "low"}
+    alerts_today = alerts_f.result() or {}
     alerts_list = sorted(
         list(alerts_today.values()),
         key=lambda x: x.get("createdAt", ""),
@@ -135,16 +235,115 @@ def get_dashboard_snapshot():
     return {
         "status": status.get("running", False),
         "threatLevel": threat.get("level", "low"),
-        "camerasActive": cameras_active_count(),
+        "camerasActive": cameras_active,
         "alertsToday": alerts_list
     }
 
 
-def push_alert_today(item: Dict[str, Any]):
-    db.reference("/dashboard/alertsToday").push(item)
+ALERTS_TODAY_MAX = 100
+ALERTS_TRIM_EVERY = 20
+_alerts_pushed = 0
+
+
+def _count_alert():
+    global _alerts_pushed
+    # Keep the node small so the createdAt query stays cheap
+    _alerts_pushed += 1
+    if _alerts_pushed % ALERTS_TRIM_EVERY == 0:
+        _enqueue("/dashboard/alertsToday", "trim", ALERTS_TODAY_MAX)
+
+
+# /system/threatLevel is global, so it is derived from every camera's latest level.
+# Only a level the writer has confirmed counts as published; a failed write is
+# forgotten so the next camera update (or a retry, if no camera is left) rewrites it.
+_camera_threats: Dict[str, str] = {}
+_published_threat: Optional[str] = None
+_pending_threat: Optional[str] = None
+_threat_lock = threading.Lock()
+THREAT_WRITE_RETRIES = 3
+THREAT_RETRY_DELAY = 2.0
+
+
+def _combined_threat() -> str:
+    return "high" if "high" in _camera_threats.values() else "low"
+
+
+def _threat_needs_write(level: str) -> bool:
+    # Compare against what the database will hold once in-flight writes land
+    target = _pending_threat if _pending_threat is not None else _published_threat
+    return level != target
+
+
+def _threat_written(level: str, retries_left: int) -> Callable[[bool], None]:
+    def on_done(ok: bool):
+        global _published_threat, _pending_threat
+        with _threat_lock:
+            if _pending_threat == level:
+                _pending_threat = None
+            if ok:
+                _published_threat = level
+                return
+            _published_threat = None
+            # Running cameras republish on their next frame; with none left, retry here
+            if not _camera_threats and retries_left > 0:
+                threading.Timer(THREAT_RETRY_DELAY, _retry_threat, args=(retries_left - 1,)).start()
+    return on_done
+
+
+def _retry_threat(retries_left: int):
+    with _threat_lock:
+        combined = _combined_threat()
+        if not _camera_threats and _threat_needs_write(combined):
+            _enqueue_threat_locked(combined, retries_left)
+
+
+def _enqueue_threat_locked(level: str, retries_left: int = THREAT_WRITE_RETRIES):
+    global _pending_threat
+    _pending_threat = level
+    _enqueue("/system/threatLevel", "set", {"level": level, "updatedAt": _now_iso()},
+             _threat_written(level, retries_left))
+
+
+def publish_camera_update(camera_id: str, threat_level: Optional[str] = None,
+                          alert: Optional[Dict[str, Any]] = None):
+    """Record a camera's threat level and/or alert, writing any change as one multi-path update.
+
+    The global threat level is only written when the level combined across all
+    cameras differs from what the database holds. `threat_level=None` leaves the
+    camera's level as it was.
+    """
+    global _pending_threat
+    with _threat_lock:
+        updates: Dict[str, Any] = {}
+        on_done = None
+        if threat_level is not None:
+            _camera_threats[camera_id] = threat_level
+            combined = _combined_threat()
+            if _threat_needs_write(combined):
+                updates["system/threatLevel"] = {"level": combined, "updatedAt": _now_iso()}
+                _pending_threat = combined
+                on_done = _threat_written(combined, THREAT_WRITE_RETRIES)
+        if alert is not None:
+            updates[f"dashboard/alertsToday/{_push_key()}"] = alert
+        if not updates:
+            return
+        # Enqueue under the lock so threat writes reach the writer in decision order
+        _enqueue("/", "update", updates, on_done)
+    if alert is not None:
+        _count_alert()
+
+
+def clear_camera_threat(camera_id: str):
+    """Forget a stopped camera's threat level, rewriting the global level if that changes it."""
+    with _threat_lock:
+        _camera_threats.pop(camera_id, None)
+        combined = _combined_threat()
+        if _threat_needs_write(combined):
+            _enqueue_threat_locked(combined)
 
 # ----- Detections & activity log -----
 def save_detection_verified(d: Dict[str, Any]):
+    # Synchronous on purpose: the admin is told it was saved and the Activity Log reads it back next
     d = {**d, "savedAt": _now_iso(), "status": d.get("status", "verified")}
     db.reference("/detections").push(d)
 
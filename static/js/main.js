@@ -87,6 +87,7 @@ function setSidebarVisible(vis){ sidebarEl?.classList.toggle('hidden', !vis); }
 // ---- Login UI ----
 function showLogin(){
   clearPageIntervals();
+  detachLiveVideo();
   setSidebarVisible(false);
   contentEl.innerHTML = document.getElementById('loginTpl').innerHTML;
   const form = document.getElementById('loginForm');
@@ -207,6 +208,7 @@ window.addEventListener('beforeunload', async () => {
 
 async function route(){
   clearPageIntervals();
+  detachLiveVideo();
   const hash = location.hash || '#/login';
   if (!currentUser) return showLogin();
 
@@ -228,37 +230,70 @@ async function route(){
 }
 
 // ---------- Video helper ----------
-function attachLiveVideo(imgEl) {
+// Frames arrive as binary Socket.IO "frame" events ({cam, jpg}) for the one camera room we watch
+const PLACEHOLDER_SRC = '/static/placeholder.jpg';
+let liveVideo = null;
+
+function watchCamera() {
+  if (!liveVideo) return;
+  const video = liveVideo;
+  socket.emit('watch', { camera: video.requested }, (cam) => {
+    if (liveVideo === video && cam) {
+      video.cam = cam;
+      video.lastAt = Date.now();
+    }
+  });
+}
+
+function resetLiveVideo() {
+  if (!liveVideo) return;
+  if (liveVideo.url) URL.revokeObjectURL(liveVideo.url);
+  liveVideo.url = null;
+  liveVideo.img.src = PLACEHOLDER_SRC;
+}
+
+socket.on('connect', () => {
+  // Rooms don't survive a reconnect
+  if (liveVideo) {
+    liveVideo.cam = null;
+    watchCamera();
+  }
+});
+
+socket.on('frame', (msg) => {
+  if (!liveVideo || !msg || !msg.jpg || msg.cam !== liveVideo.cam) return;
+  const url = URL.createObjectURL(new Blob([msg.jpg], { type: 'image/jpeg' }));
+  liveVideo.img.src = url;
+  if (liveVideo.url) URL.revokeObjectURL(liveVideo.url);
+  liveVideo.url = url;
+  liveVideo.lastAt = Date.now();
+});
+
+// camera: camera id to show, or null for the first running camera
+function attachLiveVideo(imgEl, camera = null) {
   if (!imgEl) return;
-  const PLACEHOLDER_SRC = '/static/placeholder.jpg';
-  const LIVE_SRC = () => '/api/video_feed?ts=' + Date.now();
+  detachLiveVideo();
   imgEl.src = PLACEHOLDER_SRC;
-  imgEl.dataset.live = '0';
-
-  const checkAndSwap = async () => {
-    try {
-      const data = await api('/api/status');
-      const active = Number(data.camerasActive || 0);
-      if (active > 0 && imgEl.dataset.live !== '1') {
-        imgEl.src = LIVE_SRC();
-        imgEl.dataset.live = '1';
-      } else if (active === 0 && imgEl.dataset.live !== '0') {
-        imgEl.src = PLACEHOLDER_SRC;
-        imgEl.dataset.live = '0';
-      }
-    } catch (e) {
-      console.debug('status poll failed', e?.message || e);
+  liveVideo = { img: imgEl, requested: camera, cam: null, url: null, lastAt: Date.now() };
+  watchCamera();
+
+  addInterval(() => {
+    if (!liveVideo) return;
+    if (!liveVideo.cam) return watchCamera();  // nothing running yet; retry
+    // Frames stopped (camera stopped): show the placeholder and pick again
+    if (Date.now() - liveVideo.lastAt > 3000) {
+      socket.emit('unwatch', { camera: liveVideo.cam });
+      liveVideo.cam = null;
+      resetLiveVideo();
     }
-  };
+  }, 2000);
+}
 
-  checkAndSwap();
-  addInterval(checkAndSwap, 2000);
-  imgEl.onerror = () => {
-    if (imgEl.dataset.live === '1') {
-      imgEl.src = PLACEHOLDER_SRC;
-      imgEl.dataset.live = '0';
-    }
-  };
+function detachLiveVideo() {
+  if (!liveVideo) return;
+  if (liveVideo.cam) socket.emit('unwatch', { camera: liveVideo.cam });
+  resetLiveVideo();
+  liveVideo = null;
 }
 
 // ---------- Pages ----------
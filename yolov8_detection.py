@@ -1,8 +1,10 @@
 import os
 import cv2
 import time
+import queue
 import threading
 import numpy as np
+import torch
 from typing import Dict, Any, Tuple, List
 from dotenv import load_dotenv
 from ultralytics import YOLO
@@ -10,12 +12,51 @@ from ultralytics import YOLO
 import firebase_manager as fm
 
 load_dotenv()
-MODEL_PATH = os.getenv("YOLO_MODEL_PATH", "best.pt")
+# Frames per second actually decoded and sent to YOLO; the rest are grabbed and dropped
+TARGET_FPS = float(os.getenv("YOLO_TARGET_FPS", "5"))
+# Inference size; run on CUDA in FP16 when a GPU is present, else fall back to CPU FP32
+IMGSZ = int(os.getenv("YOLO_IMGSZ", "480"))
+DEVICE = 0 if torch.cuda.is_available() else "cpu"
+HALF = DEVICE != "cpu"
+
+def _default_model_path() -> str:
+    """Prefer a runtime built by export_model.py for this host: TensorRT on GPU, INT8 OpenVINO on CPU."""
+    exported = "best.engine" if DEVICE != "cpu" else "best_openvino_model"
+    return exported if os.path.exists(exported) else "best.pt"
+
+MODEL_PATH = os.getenv("YOLO_MODEL_PATH") or _default_model_path()
+# Cross-camera batching: frames arriving within BATCH_WINDOW share one predict call
+MAX_BATCH = int(os.getenv("YOLO_MAX_BATCH", "8"))
+BATCH_WINDOW = 0.03
+# A camera counts towards the expected batch size if it submitted a frame this recently
+CAMERA_ACTIVE_WINDOW = 1.0
+# Encode settings for the video stream; browsers don't need the default quality of 95
+JPEG_QUALITY = int(os.getenv("STREAM_JPEG_QUALITY", "75"))
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 0]
+# Minimum seconds between alertsToday pushes per camera (a new label always goes through)
+ALERT_MIN_INTERVAL = 1.0
 
 # Threat mapping based on class names
 LOW_CLASSES = {"noMask", "medicalMask"}
 HIGH_CLASSES = {"other_coverings", "otherCoverings", "other_Coverings", "weapons", "weapon"}
 
+def video_room(camera_id: str) -> str:
+    """Socket.IO room (on /stream) that receives one camera's annotated JPEG frames."""
+    return f"video:{camera_id}"
+
+def normalize_label(name: str) -> str:
+    """Map the dataset's class-name variants onto the canonical labels used by the app."""
+    name_norm = name.replace(" ", "").replace("-", "").replace("_", "").lower()
+    if name_norm in {"nomask"}:
+        return "noMask"
+    elif name_norm in {"medicalmask"}:
+        return "medicalMask"
+    elif name_norm in {"othercoverings", "othercovering"}:
+        return "other_coverings"
+    elif name_norm in {"weapon", "weapons"}:
+        return "weapons"
+    return name
+
 class Detector:
     def __init__(self):
         if not os.path.exists(MODEL_PATH):
@@ -23,48 +64,76 @@ class Detector:
                 f"YOLO model not found at {MODEL_PATH}. Place your best.pt and set YOLO_MODEL_PATH."
             )
         self.model = YOLO(MODEL_PATH)
-        self.lock = threading.Lock()
+        # Exported runtimes (.engine, OpenVINO) are already fused and device-bound
+        if MODEL_PATH.endswith(".pt"):
+            if DEVICE != "cpu":
+                self.model.to("cuda")
+            self.model.fuse()
+        self.predict_kwargs = dict(verbose=False, device=DEVICE, half=HALF, imgsz=IMGSZ)
+        # Exported runtimes are built with a static batch of 1
+        self.max_batch = MAX_BATCH if MODEL_PATH.endswith(".pt") else 1
+        # Class names are fixed once the model is loaded, so normalize them up front
+        self.label_map: Dict[int, str] = {}
+        self.is_high: Dict[int, bool] = {}
+        self.color: Dict[int, Tuple[int, int, int]] = {}
+        for cls_id, name in self.model.names.items():
+            label = normalize_label(name)
+            self.label_map[int(cls_id)] = label
+            self.is_high[int(cls_id)] = label in HIGH_CLASSES
+            self.color[int(cls_id)] = (0, 255, 0) if label in LOW_CLASSES else (0, 0, 255)
+        # Warm-up so the first real frame doesn't pay cuDNN autotune / lazy init cost;
+        # cover square and 16:9 inputs since letterboxed shapes are tuned separately
+        for shape in ((IMGSZ, IMGSZ, 3), (IMGSZ * 9 // 16, IMGSZ, 3)):
+            self.model.predict(source=np.zeros(shape, np.uint8), **self.predict_kwargs)
 
-    def detect_frame(self, frame: np.ndarray) -> Tuple[np.ndarray, List[Dict[str, Any]], str]:
-        """Run detection on a frame. Returns annotated frame, detections list, and threat level."""
-        with self.lock:
-            results = self.model.predict(source=frame, verbose=False)[0]
+    def predict(self, frames: List[np.ndarray]) -> list:
+        """Run the model on a batch of frames. Not thread-safe; InferenceServer is the only caller at runtime."""
+        return self.model.predict(source=frames, **self.predict_kwargs)
 
+    @staticmethod
+    def downscale(frame: np.ndarray) -> Tuple[np.ndarray, float]:
+        """Shrink a frame so its long side is IMGSZ. Returns the small frame and the factor back to full size."""
+        h, w = frame.shape[:2]
+        scale = max(h, w) / IMGSZ
+        if scale <= 1.0:
+            return frame, 1.0
+        small = cv2.resize(frame, (round(w / scale), round(h / scale)), interpolation=cv2.INTER_AREA)
+        return small, scale
+
+    def annotate(self, frame: np.ndarray, results, annotate_in_place: bool = True,
+                 scale: float = 1.0) -> Tuple[np.ndarray, List[Dict[str, Any]], str]:
+        """Turn one YOLO result into (annotated frame, detections list, threat level).
+
+        `scale` maps boxes from the inference frame back onto `frame`. Boxes are
+        drawn directly onto `frame` unless annotate_in_place=False.
+        """
         dets: List[Dict[str, Any]] = []
         threat_level = "low"
-        for box in results.boxes:
-            cls_id = int(box.cls[0])
-            conf = float(box.conf[0])
-            xyxy = box.xyxy[0].cpu().numpy().astype(int).tolist()
-            name = results.names.get(cls_id, str(cls_id))
-            # Normalize variants
-            name_norm = name.replace(" ", "").replace("-", "").replace("_", "").lower()
-            if name_norm in {"nomask"}:
-                label = "noMask"
-            elif name_norm in {"medicalmask"}:
-                label = "medicalMask"
-            elif name_norm in {"othercoverings", "othercovering"}:
-                label = "other_coverings"
-            elif name_norm in {"weapon", "weapons"}:
-                label = "weapons"
-            else:
-                label = name
+        # One bulk device->host transfer instead of a sync per box attribute
+        arr = results.boxes.data.cpu().numpy()  # (N, 6): x1, y1, x2, y2, conf, cls
+        xyxy_int = (arr[:, :4] * scale).astype(np.int32)
+        confs = arr[:, 4]
+        clses = arr[:, 5].astype(np.int32)
+        colors = []
+        for i in range(len(arr)):
+            cls_id = int(clses[i])
+            label = self.label_map.get(cls_id, str(cls_id))
 
             # threat level
-            if label in HIGH_CLASSES:
+            if self.is_high.get(cls_id, False):
                 threat_level = "high"
 
             dets.append({
                 "label": label,
-                "conf": round(conf, 3),
-                "bbox": xyxy
+                "conf": round(float(confs[i]), 3),
+                "bbox": xyxy_int[i].tolist()
             })
+            colors.append(self.color.get(cls_id, (0, 0, 255)))
 
         # Annotate frame
-        annotated = frame.copy()
-        for d in dets:
+        annotated = frame if annotate_in_place else frame.copy()
+        for d, color in zip(dets, colors):
             x1, y1, x2, y2 = d["bbox"]
-            color = (0, 255, 0) if d["label"] in LOW_CLASSES else (0, 0, 255)
             cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
             cv2.putText(
                 annotated,
@@ -78,6 +147,13 @@ class Detector:
             )
         return annotated, dets, threat_level
 
+def open_capture(source) -> cv2.VideoCapture:
+    """Open a capture that always hands back the newest frame (1-frame buffer, MJPG)."""
+    cap = cv2.VideoCapture(source)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+    return cap
+
 detector = None
 def get_detector():
     global detector
@@ -85,6 +161,72 @@ def get_detector():
         detector = Detector()
     return detector
 
+class InferenceServer(threading.Thread):
+    """Owns the model and batches frames from every camera into a single predict call."""
+    def __init__(self, det: Detector):
+        super().__init__(daemon=True)
+        self.detector = det
+        self.queue: "queue.Queue[Tuple[str, np.ndarray, threading.Event, Dict[str, Any]]]" = queue.Queue()
+        # camera_id -> time of its last submitted frame
+        self._last_seen: Dict[str, float] = {}
+
+    def detect(self, camera_id: str, frame: np.ndarray) -> Tuple[np.ndarray, List[Dict[str, Any]], str]:
+        """Submit a frame and block until its batch has been run. Returns annotated frame, detections list, and threat level."""
+        done = threading.Event()
+        slot: Dict[str, Any] = {}
+        # Resize on the caller's thread so the shared inference thread only sees IMGSZ-sized frames
+        small, scale = self.detector.downscale(frame)
+        self._last_seen[camera_id] = time.time()
+        self.queue.put((camera_id, small, done, slot))
+        done.wait()
+        if "error" in slot:
+            raise slot["error"]
+        # Drawing happens on the caller's thread so the inference thread goes straight to the next batch
+        return self.detector.annotate(frame, slot["result"], scale=scale)
+
+    def _active_cameras(self) -> int:
+        cutoff = time.time() - CAMERA_ACTIVE_WINDOW
+        return sum(1 for ts in list(self._last_seen.values()) if ts >= cutoff)
+
+    def _next_batch(self) -> list:
+        items = [self.queue.get()]
+        # Stop waiting once every active camera has a frame in the batch; a lone camera never waits
+        target = min(self.detector.max_batch, max(1, self._active_cameras()))
+        deadline = time.time() + BATCH_WINDOW
+        while len({cam for cam, _, _, _ in items}) < target:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def run(self):
+        while True:
+            items = self._next_batch()
+            try:
+                results = self.detector.predict([frame for _, frame, _, _ in items])
+                for (_, _, _, slot), res in zip(items, results):
+                    slot["result"] = res
+            except Exception as e:
+                for _, _, _, slot in items:
+                    slot["error"] = e
+            finally:
+                for _, _, done, _ in items:
+                    done.set()
+
+inference_server = None
+_inference_server_lock = threading.Lock()
+def get_inference_server():
+    global inference_server
+    with _inference_server_lock:
+        if inference_server is None:
+            inference_server = InferenceServer(get_detector())
+            inference_server.start()
+    return inference_server
+
 class CameraWorker(threading.Thread):
     def __init__(self, camera_id: str, source, socketio=None):
         super().__init__(daemon=True)
@@ -93,74 +235,115 @@ class CameraWorker(threading.Thread):
         self.socketio = socketio
         self.capture = None
         self.running = False
+        self._last_alert_ts = 0.0
+        self._last_alert_label = None
+        # Newest decoded frame handed from the capture thread to the inference loop
+        self._latest: "queue.Queue[np.ndarray]" = queue.Queue(maxsize=1)
 
-    def run(self):
-        self.capture = cv2.VideoCapture(self.source)
-        self.running = True
-        fm.set_system_status(True)
+    def _capture_loop(self):
+        """Grab continuously and keep only the newest decoded frame in the 1-slot queue."""
+        try:
+            min_interval = 1.0 / TARGET_FPS
+            last_deliver_ts = 0.0
+            while self.running:
+                # grab() paces to the camera FPS; only decode frames we will run inference on
+                if not self.capture.grab():
+                    time.sleep(0.2)
+                    continue
+                now = time.time()
+                if now - last_deliver_ts < min_interval:
+                    continue
+                ok, frame = self.capture.retrieve()
+                if not ok:
+                    continue
+                last_deliver_ts = now
+                # Replace an unconsumed frame rather than letting inference fall behind
+                try:
+                    self._latest.get_nowait()
+                except queue.Empty:
+                    pass
+                self._latest.put_nowait(frame)
+        finally:
+            # If capture itself fails, stop the worker so run() can release and clean up
+            self.running = False
+
+    def _process_frame(self, server: InferenceServer, frame: np.ndarray):
+        """Detect on one frame, stream it, and publish threat/alerts/detections."""
+        now = time.time()
 
-        while self.running:
-            ok, frame = self.capture.read()
-            if not ok:
-                time.sleep(0.2)
-                continue
+        annotated, dets, threat = server.detect(self.camera_id, frame)
 
-            annotated, dets, threat = get_detector().detect_frame(frame)
-            fm.set_threat_level(threat)
+        # Encode once and broadcast as a binary Socket.IO event to dashboards watching this camera
+        if self.socketio:
+            ok, jpeg = cv2.imencode('.jpg', annotated, JPEG_PARAMS)
+            if ok:
+                self.socketio.emit("frame", {"cam": self.camera_id, "jpg": jpeg.tobytes()},
+                                   namespace="/stream", to=video_room(self.camera_id))
 
-            # Push rolling alerts
-            if dets:
-                first = dets[0]
-                fm.push_alert_today({
+        # Threat level and rolling alert go out as a single RTDB write, only when something changed
+        alert = None
+        if dets:
+            first = dets[0]
+            if now - self._last_alert_ts > ALERT_MIN_INTERVAL or first["label"] != self._last_alert_label:
+                alert = {
                     "label": first["label"],
                     "camera": self.camera_id,
                     "conf": first["conf"],
                     "createdAt": time.time()
-                })
-
-                payload = {
-                    "camera": self.camera_id,
-                    "time": time.time(),
-                    "detections": dets,
-                    "threatLevel": threat
                 }
+                self._last_alert_ts = now
+                self._last_alert_label = first["label"]
+        fm.publish_camera_update(self.camera_id, threat, alert)
 
-                if self.socketio:
-                    # Send detections to frontend
-                    self.socketio.emit("pending_detection", payload, namespace="/stream")
+        if dets:
+            payload = {
+                "camera": self.camera_id,
+                "time": time.time(),
+                "detections": dets,
+                "threatLevel": threat
+            }
 
-                    # 🚨 Siren only for high-threat *specific* labels
-                    for d in dets:
-                        if d["label"] in HIGH_CLASSES:
-                            self.socketio.emit("high_threat", {"label": d["label"], **payload}, namespace="/stream")
-                            break
+            if self.socketio:
+                # Send detections to frontend
+                self.socketio.emit("pending_detection", payload, namespace="/stream")
 
-            # tiny sleep to avoid pegging CPU
-            time.sleep(0.02)
+                # 🚨 Siren only for high-threat *specific* labels
+                for d in dets:
+                    if d["label"] in HIGH_CLASSES:
+                        self.socketio.emit("high_threat", {"label": d["label"], **payload}, namespace="/stream")
+                        break
 
-        if self.capture:
-            self.capture.release()
-        fm.set_system_status(False)
+    def run(self):
+        self.capture = open_capture(self.source)
+        self.running = True
+        fm.set_system_status(True)
+
+        capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        capture_thread.start()
+        try:
+            # A model that can't load is fatal for this worker; starting cameras again retries it
+            try:
+                server = get_inference_server()
+            except Exception as e:
+                print(f"❌ Camera {self.camera_id}: model failed to load, stopping: {e}")
+                return
+            while self.running:
+                try:
+                    frame = self._latest.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                try:
+                    self._process_frame(server, frame)
+                except Exception as e:
+                    # A bad frame (inference, encode or emit failure) shouldn't kill the camera
+                    print(f"⚠️ Camera {self.camera_id}: frame skipped: {e}")
+        finally:
+            self.running = False
+            capture_thread.join()
+            if self.capture:
+                self.capture.release()
+            fm.clear_camera_threat(self.camera_id)
+            fm.set_system_status(False)
 
     def stop(self):
         self.running = False
-
-# MJPEG generator for a given source
-def mjpeg_generator(source):
-    cap = cv2.VideoCapture(source)
-    while True:
-        ok, frame = cap.read()
-        if not ok:
-            time.sleep(0.2)
-            continue
-        annotated, dets, threat = get_detector().detect_frame(frame)
-        fm.set_threat_level(threat)
-        ret, jpeg = cv2.imencode('.jpg', annotated)
-        if not ret:
-            continue
-        frame_bytes = jpeg.tobytes()
-        yield (
-            b'--frame\r\n'
-            b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n'
-        )
-    cap.release()